@@ -1,56 +1,258 @@
 """
 main.py
 FastAPI Tutorial
-Usage: uvicorn main:app --reload
+Usage: uvicorn main:app --reload --loop uvloop --http httptools
 """
+import email.message
+import hashlib
+import re
 from enum import Enum
-from typing import Union
+from typing import Annotated, Union
 
-from fastapi import FastAPI, Path, Query
-from pydantic import BaseModel, Required
+import msgspec
+import orjson
+from fastapi import Depends, FastAPI, Path, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, Response
+from starlette.datastructures import Headers
+from starlette.websockets import WebSocketClose
 
 
 fake_items_db = [{"item_name": "Foo"}, {"item_name": "Bar"}, {"item_name": "Baz"}]
+# fake_items_db never changes, so each entry is encoded once
+_DB_ENCODED = tuple(orjson.dumps(item) for item in fake_items_db)
 
 
 # create the data model
-class Item(BaseModel):
+# msgspec structs are slotted C objects, much smaller and cheaper to build
+# than pydantic models
+class Item(msgspec.Struct, frozen=True, kw_only=True):
     name: str
     description: Union[str, None] = None
     price: float
     tax: Union[float, None] = None
 
 
+# msgspec only reports where validation failed in its error text, so the field
+# location is parsed out of messages such as "Object missing required field
+# `price`" and "Expected `float`, got `str` - at `$.price`". That wording is
+# part of this module's contract; requirements.txt pins the msgspec releases it
+# was checked against.
+_MISSING_FIELD = re.compile(r"Object missing required field `(\w+)`")
+
+
+def _item_error(exc: msgspec.DecodeError, body: bytes) -> dict:
+    """
+    describe a failed Item decode the way FastAPI reports request body errors
+    """
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as err:
+        return {
+            "type": "json_invalid",
+            "loc": ("body", err.pos),
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": err.msg},
+        }
+
+    # msgspec appends the location as " - at `$.field`"
+    msg, _, path = str(exc).partition(" - at `$")
+    loc = ["body", *path.rstrip("`").split(".")[1:]]
+    value = data
+    for key in loc[1:]:
+        value = value[key]
+
+    missing = _MISSING_FIELD.match(msg)
+    if missing:
+        loc.append(missing.group(1))
+        return {
+            "type": "missing",
+            "loc": tuple(loc),
+            "msg": "Field required",
+            "input": value,
+        }
+    return {"type": "value_error", "loc": tuple(loc), "msg": msg, "input": value}
+
+
+def _is_json(content_type: Union[str, None]) -> bool:
+    """
+    apply FastAPI's rule for which request bodies are parsed as JSON
+    """
+    if not content_type:
+        return True
+    message = email.message.Message()
+    message["content-type"] = content_type
+    if message.get_content_maintype() != "application":
+        return False
+    subtype = message.get_content_subtype()
+    return subtype == "json" or subtype.endswith("+json")
+
+
+async def parse_item(request: Request) -> Item:
+    """
+    decode and validate the request body as an Item
+    """
+    body = await request.body()
+    if not body:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "missing",
+                    "loc": ("body",),
+                    "msg": "Field required",
+                    "input": None,
+                }
+            ]
+        )
+    if not _is_json(request.headers.get("content-type")):
+        # e.g. text/plain, which browsers may send cross-origin without preflight
+        raise RequestValidationError(
+            [
+                {
+                    "type": "model_attributes_type",
+                    "loc": ("body",),
+                    "msg": "Input should be a valid dictionary or object to extract "
+                    "fields from",
+                    "input": body,
+                }
+            ]
+        )
+    try:
+        # strict=False coerces strings such as "1" the way pydantic did
+        return msgspec.json.decode(body, type=Item, strict=False)
+    except msgspec.DecodeError as exc:
+        raise RequestValidationError([_item_error(exc, body)]) from exc
+
+
+# Item is read by a dependency rather than as a body field, so its schema is
+# added to the OpenAPI document by hand: the Item component is merged into
+# components.schemas (see _openapi below) and the operations reference it.
+(_ITEM_REF,), _ITEM_COMPONENTS = msgspec.json.schema_components(
+    [Item], ref_template="#/components/schemas/{name}"
+)
+_ITEM_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": _ITEM_REF}},
+    },
+    "responses": {
+        "422": {
+            "description": "Validation Error",
+            "content": {
+                "application/json": {
+                    "schema": {"$ref": "#/components/schemas/HTTPValidationError"}
+                }
+            },
+        }
+    },
+}
+
+
+class StaticETagMiddleware:
+    """
+    answer If-None-Match with 304 Not Modified for paths whose body never changes
+
+    Only requests without a query string are checked, so a handler that sends
+    the same body for an explicit query (/params/default/?q=fixedquery) still
+    answers those requests in full.
+    """
+
+    def __init__(self, app, etags: dict[str, str]):
+        self.app = app
+        self.etags = etags
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            path = scope["path"]
+            # servers include root_path in path; strip it like the router does
+            root_path = scope.get("root_path", "")
+            if root_path and path.startswith(root_path + "/"):
+                path = path[len(root_path) :]
+            etag = None if scope["query_string"] else self.etags.get(path)
+            if etag is not None:
+                if_none_match = Headers(scope=scope).get("if-none-match")
+                if if_none_match is not None and (
+                    if_none_match == "*" or etag in if_none_match
+                ):
+                    response = Response(status_code=304, headers={"ETag": etag})
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+def _etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2s(body).hexdigest()
+
+
 # create a FastAPI instance
-app = FastAPI()
+# serialize responses with orjson instead of the stdlib json module
+app = FastAPI(default_response_class=ORJSONResponse)
+_fastapi_openapi = app.openapi
 
 
-# create a path operation decorator
-@app.get("/")
+def _openapi() -> dict:
+    """
+    add the Item component to FastAPI's generated OpenAPI document
+    """
+    if app.openapi_schema is None:
+        schema = _fastapi_openapi()
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(
+            _ITEM_COMPONENTS
+        )
+    return app.openapi_schema
+
+
+app.openapi = _openapi
+
+
+# constant response bodies are serialized once at import
+_HELLO = orjson.dumps({"message": "Hello World"})
+_USER_ME = orjson.dumps({"user_id": "the current user"})
+_ITEMS = [{"item_id": "Foo"}, {"item_id": "Bar"}]
+_RESULTS_BYTES = orjson.dumps({"items": _ITEMS})
+_DEFAULT_BYTES = orjson.dumps({"items": _ITEMS, "q": "fixedquery"})
+_HELLO_ETAG = _etag(_HELLO)
+_USER_ME_ETAG = _etag(_USER_ME)
+_RESULTS_ETAG = _etag(_RESULTS_BYTES)
+_DEFAULT_ETAG = _etag(_DEFAULT_BYTES)
+
+# repeat clients holding a current ETag skip the body entirely
+app.add_middleware(
+    StaticETagMiddleware,
+    etags={
+        "/": _HELLO_ETAG,
+        "/users/me": _USER_ME_ETAG,
+        "/params/items/": _RESULTS_ETAG,
+        "/params/default/": _DEFAULT_ETAG,
+    },
+)
+
+
+# The trivial path operations are registered together from ROUTES, after
+# read_items_default, instead of with a path operation decorator.
+# Handlers stay `async def` even when they never await: FastAPI runs plain
+# `def` handlers in a threadpool, which costs more than creating a coroutine.
 async def root():
     """
     define the path operation function
     """
     # return the content
-    return {"message": "Hello World"}
+    return Response(
+        content=_HELLO, media_type="application/json", headers={"ETag": _HELLO_ETAG}
+    )
 
 
 ## Path Parameters
-# Path parameters with types
-@app.get("/items/{item_id}")
-async def read_item(item_id: int):
-    return {"item_id": item_id}
-
-
-# Order matters
-@app.get("/users/me")
+# Order matters: /users/me is listed before /users/{user_id} in ROUTES
 async def read_user_me():
-    return {"user_id": "the current user"}
+    return Response(
+        content=_USER_ME, media_type="application/json", headers={"ETag": _USER_ME_ETAG}
+    )
 
 
-@app.get("/users/{user_id}")
 async def read_user(user_id: str):
-    return {"user_id": user_id}
+    return ORJSONResponse({"user_id": user_id})
 
 
 # Predefined values
@@ -60,25 +262,44 @@ class ModelName(str, Enum):
     lenet = "lenet"
 
 
+# Enumeration members are hashable, so they can key a lookup table
+_MODEL_MSG = {
+    ModelName.alexnet: "Deep Learning FTW!",
+    ModelName.resnet: "Have some residuals",
+    ModelName.lenet: "LeCNN all the images",
+}
+
+
 # Declare a path parameter
 @app.get("/models/{model_name}")
 async def get_model(model_name: ModelName):
-    # Working with Python enumerations
-    if model_name is ModelName.alexnet:
-        return {"model_name": model_name, "message": "Deep Learning FTW!"}
-
-    # Get the enumeration value
-    if model_name.value == "lenet":
-        return {"model_name": model_name, "message": "LeCNN all the images"}
-
     # Return enumeration members
-    return {"model_name": model_name, "message": "Have some residuals"}
+    return ORJSONResponse(
+        {"model_name": model_name, "message": _MODEL_MSG[model_name]}
+    )
 
 
 # Path parameters containing paths
-@app.get("/files/{file_path:path}")
-async def read_file(file_path: str):
-    return {"file_path": file_path}
+# The path is echoed back by a bare ASGI app mounted on /files, which skips the
+# router's path regex and FastAPI's parameter handling.
+async def read_file(scope, receive, send):
+    if scope["type"] != "http":
+        # no websocket route here, close the connection like the router does
+        await WebSocketClose()(scope, receive, send)
+        return
+
+    # scope["path"] still starts with root_path, which ends with the mount prefix
+    route_path = scope["path"][len(scope["root_path"]) :]
+    if scope["method"] != "GET":
+        response = ORJSONResponse(
+            {"detail": "Method Not Allowed"}, status_code=405, headers={"Allow": "GET"}
+        )
+    else:
+        response = ORJSONResponse({"file_path": route_path[1:]})
+    await response(scope, receive, send)
+
+
+app.mount("/files", read_file)
 
 
 ## Query Parameters
@@ -92,15 +313,19 @@ async def read_item_query(skip: int = 0, limit: int = 10):
     skip is an int with a default value of 0
     limit is an int with a default value of 10
     """
-    return fake_items_db[skip : skip + limit]
+    content = b"[" + b",".join(_DB_ENCODED[skip : skip + limit]) + b"]"
+    return Response(content=content, media_type="application/json")
 
 
 # Optional parameters
 @app.get("/query/optional/{item_id}")
 async def read_item_optional(item_id: str, q: Union[str, None] = None):
     if q:
-        return {"item_id": item_id, "q": q}
-    return {"item_id": item_id}
+        return ORJSONResponse({"item_id": item_id, "q": q})
+    return ORJSONResponse({"item_id": item_id})
+
+
+_DESC_UPDATE = {"description": "This is an amazing item that has a long description"}
 
 
 # Query parameter type conversion
@@ -112,16 +337,16 @@ async def read_item_bool(item_id: str, q: Union[str, None] = None, short: bool =
     q is an optional string
     short is an bool with a default value of False
     """
-    item = {"item_id": item_id}
-
-    if q:
-        item.update({"q": q})
-
-    if not short:
-        item.update(
-            {"description": "This is an amazing item that has a long description"}
-        )
-    return item
+    # build each of the four possible shapes in a single dict display
+    if q and short:
+        item = {"item_id": item_id, "q": q}
+    elif q:
+        item = {"item_id": item_id, "q": q, **_DESC_UPDATE}
+    elif short:
+        item = {"item_id": item_id}
+    else:
+        item = {"item_id": item_id, **_DESC_UPDATE}
+    return ORJSONResponse(item)
 
 
 # Multiple path and query parameters
@@ -131,14 +356,15 @@ async def read_item_bool(item_id: str, q: Union[str, None] = None, short: bool =
 async def read_user_item(
     user_id: int, item_id: str, q: Union[str, None] = None, short: bool = False
 ):
-    item = {"item_id": item_id, "owner_id": user_id}
-    if q:
-        item.update({"q": q})
-    if not short:
-        item.update(
-            {"description": "This is an amazing item that has a long description"}
-        )
-    return item
+    if q and short:
+        item = {"item_id": item_id, "owner_id": user_id, "q": q}
+    elif q:
+        item = {"item_id": item_id, "owner_id": user_id, "q": q, **_DESC_UPDATE}
+    elif short:
+        item = {"item_id": item_id, "owner_id": user_id}
+    else:
+        item = {"item_id": item_id, "owner_id": user_id, **_DESC_UPDATE}
+    return ORJSONResponse(item)
 
 
 # Required query parameters
@@ -155,97 +381,103 @@ async def read_user_item_required(
     limit is an optional int
     """
     item = {"item_id": item_id, "needy": needy, "skip": skip, "limit": limit}
-    return item
+    return ORJSONResponse(item)
 
 
 # Request Body
 # To send data, we should use: POST (most common), PUT, DELETE, or PATCH.
-@app.post("/request/items/")
-async def create_item(item: Item):
-    item_dict = item.dict()
+@app.post("/request/items/", response_model=None, openapi_extra=_ITEM_BODY)
+async def create_item(item: Item = Depends(parse_item)):
+    item_dict = msgspec.structs.asdict(item)
 
     if item.tax:
         price_with_tax = item.price + item.tax
         item_dict.update({"price_with_tax": price_with_tax})
 
-    return item_dict
+    return ORJSONResponse(item_dict)
 
 
 # Request body + path parameters
-@app.put("/request/items/{item_id}")
-async def create_item_body_path(item_id: int, item: Item):
-    return {"item_id": item_id, **item.dict()}
-
-
-# Request body + path + query parameters
-@app.put("/request/items/{item_id}")
-async def create_item_query(item_id: int, item: Item, q: Union[str, None] = None):
-    result = {"item_id": item_id, **item.dict()}
-
-    if q:
-        result.update({"q": q})
-
-    return result
+@app.put("/request/items/{item_id}", response_model=None, openapi_extra=_ITEM_BODY)
+async def create_item_body_path(item_id: int, item: Item = Depends(parse_item)):
+    return ORJSONResponse({"item_id": item_id, **msgspec.structs.asdict(item)})
 
 
 # Query Parameters and String Validations
 
 # Additional validation
 # Use Query as the default value
-@app.get("/params/items/")
-async def read_items(q: Union[str, None] = Query(default=None, max_length=50)):
-    results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
+async def read_items_max_length(
+    q: Union[str, None] = Query(default=None, max_length=50)
+):
     if q:
-        results.update({"q": q})
-    return results
+        return ORJSONResponse({"items": _ITEMS, "q": q})
+    return Response(
+        content=_RESULTS_BYTES,
+        media_type="application/json",
+        headers={"ETag": _RESULTS_ETAG},
+    )
 
 
 # Add more validations
 # Add regular expressions
 
 # Default values
-@app.get("/params/default/")
-async def read_items(q: str = Query(default="fixedquery", min_length=3)):
+async def read_items_default(q: str = Query(default="fixedquery", min_length=3)):
     """
     q query parameter has min_length of 3 with default value of "fixedquery".
     Having a default value also makes the parameter optional.
     """
-    results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
-    if q:
-        results.update({"q": q})
-    return results
+    # q is never empty here; the default value has a precomputed body. Its ETag
+    # only earns a 304 when q was omitted (see StaticETagMiddleware).
+    if q == "fixedquery":
+        return Response(
+            content=_DEFAULT_BYTES,
+            media_type="application/json",
+            headers={"ETag": _DEFAULT_ETAG},
+        )
+    return ORJSONResponse({"items": _ITEMS, "q": q})
 
 
-# Make it required
-# If need to declare a value as required when using Query,
-# we can simply not declare a default value.
-# http://127.0.0.1:8000/params/required/
-# http://127.0.0.1:8000/params/required/?q=hello
-@app.get("/params/required/")
-async def read_items(q: str = Query(min_length=3)):
-    results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
-    if q:
-        results.update({"q": q})
-    return results
+# Register the trivial routes in one place, sharing the same options
+ROUTES = [
+    ("/", root, ["GET"]),
+    ("/users/me", read_user_me, ["GET"]),
+    ("/users/{user_id}", read_user, ["GET"]),
+    ("/params/items/", read_items_max_length, ["GET"]),
+    ("/params/default/", read_items_default, ["GET"]),
+]
+
+
+def _register(routes):
+    for path, endpoint, methods in routes:
+        app.add_api_route(path, endpoint, methods=methods, response_model=None)
+
+
+_register(ROUTES)
+
+
+# Query and Path declarations shared by several parameters are built once.
+# They are attached with Annotated, which gives every parameter its own copy,
+# so a shared instance can't leak one parameter's type into another.
+_Q_MIN3 = Query(min_length=3)
+_PATH_ID = Path(title="The ID of the item to get", gt=0, le=1000)
 
 
 # Required with None
 @app.get("/params/none/")
-async def read_items(q: Union[str, None] = Query(default=..., min_length=3)):
-    results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
-    if q:
-        results.update({"q": q})
-    return results
+async def read_items(q: Annotated[Union[str, None], _Q_MIN3]):
+    return ORJSONResponse({"items": _ITEMS, "q": q})
 
 
-# Use Pydantic Required instead of Ellipsis
-# If you feel uncomfortable using ..., you can also import and use Required from Pydantic.
+# Make it required
+# If need to declare a value as required when using Query,
+# we can simply not declare a default value.
+# http://127.0.0.1:8000/params/required/
+# http://127.0.0.1:8000/params/required/?q=hello
 @app.get("/params/required/")
-async def read_items(q: str = Query(default=Required, min_length=3)):
-    results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
-    if q:
-        results.update({"q": q})
-    return results
+async def read_items(q: Annotated[str, _Q_MIN3]):
+    return ORJSONResponse({"items": _ITEMS, "q": q})
 
 
 # Query parameter list / multiple values
@@ -256,7 +488,7 @@ async def read_items(q: Union[list[str], None] = Query(default=None)):
     q can appear multiple times in the URL
     """
     query_items = {"q": q}
-    return query_items
+    return ORJSONResponse(query_items)
 
 
 # Query parameter list / multiple values with defaults
@@ -265,39 +497,27 @@ async def read_items(q: Union[list[str], None] = Query(default=None)):
 @app.get("/params/multiple/defaults/")
 async def read_items(q: list[str] = Query(default=["foo", "bar"])):
     query_items = {"q": q}
-    return query_items
+    return ORJSONResponse(query_items)
 
 
 # Path Parameters and Numeric Validations
 # We can declare the same type of validations and metadata for path parameters.
+# Order the parameters as you need; a leading * makes them keyword-only.
+# Number validations: greater than and less than or equal
 @app.get("/items/{item_id}")
 async def read_items(
-    item_id: int = Path(title="The ID of the item to get"),
-    q: Union[str, None] = Query(default=None, alias="item-query"),
+    *,
+    item_id: Annotated[int, _PATH_ID],
+    q: Union[str, None] = None,
 ):
     results = {"item_id": item_id}
     if q:
         results.update({"q": q})
-    return results
+    return ORJSONResponse(results)
 
 
-# Order the parameters as you need
-@app.get("/items/{item_id}")
-async def read_items(q: str, item_id: int = Path(title="The ID of the item to get")):
-    results = {"item_id": item_id}
-    if q:
-        results.update({"q": q})
-    return results
 
+if __name__ == "__main__":
+    import uvicorn
 
-# Number validations: greater than and less than or equal
-@app.get("/items/{item_id}")
-async def read_items(
-    *,
-    item_id: int = Path(title="The ID of the item to get", gt=0, le=1000),
-    q: str,
-):
-    results = {"item_id": item_id}
-    if q:
-        results.update({"q": q})
-    return results
+    uvicorn.run("main:app", loop="uvloop", http="httptools")